@@ -1,22 +1,29 @@
-import sys
 import traceback
 import platform
+from logging import Logger, getLogger
 from datetime import datetime
-from typing import Any, Callable, Optional, Union, Type
-from types import TracebackType, coroutine
+from typing import Any, Callable, Coroutine, Optional, Union, Type
+from types import TracebackType
 from threading import Thread
 from asyncio import (
     get_running_loop,
+    gather,
+    sleep,
     new_event_loop,
     set_event_loop,
     run_coroutine_threadsafe,
     AbstractEventLoop,
-    Future,
+    Task,
     set_event_loop_policy
 )
 from json import loads
+from collections import deque
+from codecs import CodecInfo, lookup
+from concurrent.futures import Future
+from urllib.parse import SplitResult, unquote, urlsplit
+from urllib.request import getproxies, proxy_bypass
 
-from aiohttp import ClientSession, ClientResponse, TCPConnector
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, BasicAuth
 
 
 # 在Windows系统上必须使用Selector事件循环，否则可能导致程序崩溃
@@ -24,12 +31,24 @@ if platform.system() == 'Windows':
     from asyncio import WindowsSelectorEventLoopPolicy
     set_event_loop_policy(WindowsSelectorEventLoopPolicy())
 
+# 安装了uvloop时，客户端自行创建的事件循环优先使用uvloop（不支持Windows）
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
 
 CALLBACK_TYPE = Callable[[dict, "Request"], None]
 ON_FAILED_TYPE = Callable[[int, "Request"], None]
 ON_ERROR_TYPE = Callable[[Type, Exception, TracebackType, "Request"], None]
 
 
+logger: Logger = getLogger(__name__)
+
+# 每轮事件循环中最多取出的待处理请求数量
+DRAIN_BATCH_SIZE: int = 16
+
+
 class Request(object):
     """
     请求对象
@@ -45,6 +64,20 @@ class Request(object):
     extra: 任意其他数据（用于回调时获取）
     """
 
+    __slots__ = (
+        "method",
+        "path",
+        "callback",
+        "params",
+        "data",
+        "json",
+        "headers",
+        "on_failed",
+        "on_error",
+        "extra",
+        "response",
+    )
+
     def __init__(
         self,
         method: str,
@@ -73,44 +106,83 @@ class Request(object):
 
         self.response: "Response" = None
 
-    def __str__(self):
+    def __str__(self) -> str:
         """字符串表示"""
         if self.response is None:
             status_code = "terminated"
+            text = ""
         else:
             status_code = self.response.status_code
+            text = self.response.preview()
 
         return (
-            "request : {} {} because {}: \n"
-            "headers: {}\n"
-            "params: {}\n"
-            "data: {}\n"
-            "json: {}\n"
-            "response:"
-            "{}\n".format(
-                self.method,
-                self.path,
-                status_code,
-                self.headers,
-                self.params,
-                self.data,
-                self.json,
-                "" if self.response is None else self.response.text,
-            )
+            f"request : {self.method} {self.path} because {status_code}: \n"
+            f"headers: {self.headers}\n"
+            f"params: {self.params}\n"
+            f"data: {self.data}\n"
+            f"json: {self.json}\n"
+            f"response:{text}\n"
         )
 
 
 class Response:
     """结果对象"""
 
-    def __init__(self, status_code: int, text: str) -> None:
+    __slots__ = ("status_code", "content", "encoding")
+
+    # 解析JSON数据的函数，默认使用标准库json，可替换为orjson.loads来提升速度
+    # 注意orjson会将超过64位的整数解析为浮点数（丢失精度），且不支持NaN和UTF-8 BOM
+    json_loads: Callable[[Union[bytes, str]], Any] = loads
+
+    def __init__(
+        self,
+        status_code: int,
+        content: Union[bytes, str],
+        encoding: str = "utf-8"
+    ) -> None:
         """"""
         self.status_code: int = status_code
-        self.text: str = text
+
+        # 兼容直接传入字符串的用法，统一转换为UTF-8字节数据保存
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+            encoding = "utf-8"
+
+        self.content: bytes = content
+
+        # 校验服务器声明的编码，无法识别或不是文本编码时使用UTF-8
+        try:
+            codec: CodecInfo = lookup(encoding)
+        except LookupError:
+            codec = None
+
+        if codec and codec._is_text_encoding:
+            self.encoding: str = codec.name
+        else:
+            self.encoding = "utf-8"
+
+    @property
+    def text(self) -> str:
+        """获取返回数据对应的字符串（用到时才解码）"""
+        return self.content.decode(self.encoding, errors="replace")
+
+    def preview(self, length: int = 512) -> str:
+        """获取返回数据开头部分的字符串（用于日志输出）"""
+        text: str = self.content[:length].decode(self.encoding, errors="replace")
+        if len(self.content) > length:
+            text += "..."
+        return text
 
     def json(self) -> dict:
-        """获取字符串对应的JSON格式数据"""
-        data = loads(self.text)
+        """获取返回数据对应的JSON格式数据"""
+        # 通过类获取，避免Python函数被绑定为实例方法
+        json_loads: Callable[[Union[bytes, str]], Any] = type(self).json_loads
+
+        # UTF-8编码时直接解析原始字节，省去一次解码
+        if self.encoding == "utf-8":
+            data = json_loads(self.content)
+        else:
+            data = json_loads(self.text)
         return data
 
 
@@ -123,44 +195,92 @@ class RestClient(object):
     * 重载on_error方法来实现请求异常的标准回调处理
     """
 
-    def __init__(self):
+    def __init__(self) -> None:
         """"""
         self.url_base: str = ""
         self.proxy: str = None
+        self.proxy_auth: BasicAuth = None
+        self.pool_size: int = 100
+        self.keepalive_timeout: float = 15
+        self.timeout: float = 30
+        self.rate_limit: float = 0
+        self.rate_tat: float = 0
 
         self.connector: TCPConnector = None
         self.session: ClientSession = None
         self.loop: AbstractEventLoop = None
+        self.thread: Thread = None
+        self.tasks: set[Task] = set()
+
+        self.pending_requests: deque[Request] = deque()
+        self.drain_scheduled: bool = False
+        self.active: bool = False
 
     def init(
         self,
         url_base: str,
         proxy_host: str = "",
-        proxy_port: int = 0
+        proxy_port: int = 0,
+        pool_size: int = 100,
+        keepalive_timeout: float = 15,
+        timeout: float = 30,
+        rate_limit: float = 0
     ) -> None:
-        """传入REST API的根地址，初始化客户端"""
+        """
+        传入REST API的根地址，初始化客户端
+
+        url_base: REST API的根地址
+        proxy_host: 代理服务器地址
+        proxy_port: 代理服务器端口
+        pool_size: 连接池的最大连接数
+        keepalive_timeout: 空闲连接的保持时间（秒）
+        timeout: 单次请求的超时时间（秒）
+        rate_limit: 每秒最大请求数，0表示不限制
+        """
         self.url_base = url_base
+        self.proxy = None
+        self.proxy_auth = None
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = timeout
+        self.rate_limit = rate_limit
 
         if proxy_host and proxy_port:
             self.proxy = f"http://{proxy_host}:{proxy_port}"
+        # 否则提前读取一次环境变量中的代理设置，避免每次请求时重复查找
+        else:
+            self.proxy, self.proxy_auth = get_env_proxy(url_base)
 
     def start(self) -> None:
         """启动客户端的事件循环"""
         try:
             self.loop = get_running_loop()
         except RuntimeError:
-            self.loop = new_event_loop()
+            if uvloop:
+                self.loop = uvloop.new_event_loop()
+            else:
+                self.loop = new_event_loop()
+
+        self.active = True
 
-        start_event_loop(self.loop)
+        # 旧事件循环上的批量处理不会再执行，重置标志并调度停止期间加入的请求
+        self.drain_scheduled = False
+
+        if self.pending_requests:
+            self.drain_scheduled = True
+            self.loop.call_soon_threadsafe(self._drain_requests)
+
+        self.thread = start_event_loop(self.loop)
 
     def stop(self) -> None:
         """停止客户端的事件循环"""
         if self.loop and self.loop.is_running():
-            self.loop.stop()
+            run_coroutine_threadsafe(self._close(), self.loop)
 
     def join(self) -> None:
         """等待子线程退出"""
-        pass
+        if self.thread:
+            self.thread.join()
 
     def add_request(
         self,
@@ -189,8 +309,24 @@ class RestClient(object):
             extra,
         )
 
-        coro: coroutine = self._process_request(request)
-        run_coroutine_threadsafe(coro, self.loop)
+        # 放入待处理队列，同一轮事件循环中只需唤醒一次来批量处理
+        self.pending_requests.append(request)
+
+        # 客户端已停止（事件循环已关闭）时，请求留在队列中，重新启动后再处理
+        if self.loop and self.loop.is_closed():
+            return request
+
+        if not self.drain_scheduled:
+            self.drain_scheduled = True
+
+            try:
+                self.loop.call_soon_threadsafe(self._drain_requests)
+            # 调度失败时（如尚未启动）撤销本次请求并恢复标志，避免后续请求无法被调度
+            except Exception:
+                self.drain_scheduled = False
+                self.pending_requests.remove(request)
+                raise
+
         return request
 
     def request(
@@ -204,80 +340,168 @@ class RestClient(object):
     ) -> Response:
         """同步请求函数"""
         request: Request = Request(method, path, params, data, json, headers)
-        coro: coroutine = self._get_response(request)
+        coro: Coroutine = self._get_response(request)
         fut: Future = run_coroutine_threadsafe(coro, self.loop)
         return fut.result()
 
-    def sign(self, request: Request) -> None:
+    def sign(self, request: Request) -> Request:
         """签名函数（由用户继承实现具体签名逻辑）"""
         return request
 
     def on_failed(self, status_code: int, request: Request) -> None:
         """请求失败的默认回调"""
-        print("RestClient on failed" + "-" * 10)
-        print(str(request))
+        logger.warning("RestClient on failed, status code: %s\n%s", status_code, request)
 
     def on_error(
         self,
         exception_type: type,
         exception_value: Exception,
-        tb,
+        tb: TracebackType,
         request: Optional[Request],
     ) -> None:
         """请求触发异常的默认回调"""
-        try:
-            print("RestClient on error" + "-" * 10)
-            print(self.exception_detail(exception_type, exception_value, tb, request))
-        except Exception:
-            traceback.print_exc()
+        logger.error(
+            "RestClient on error\nrequest:%s",
+            request,
+            exc_info=(exception_type, exception_value, tb)
+        )
 
     def exception_detail(
         self,
         exception_type: type,
         exception_value: Exception,
-        tb,
+        tb: TracebackType,
         request: Optional[Request],
-    ) -> None:
+    ) -> str:
         """将异常信息转化生成字符串"""
-        text = "[{}]: Unhandled RestClient Error:{}\n".format(
-            datetime.now().isoformat(), exception_type
-        )
-        text += "request:{}\n".format(request)
-        text += "Exception trace: \n"
-        text += "".join(
+        trace: str = "".join(
             traceback.format_exception(exception_type, exception_value, tb)
         )
+
+        text: str = (
+            f"[{datetime.now().isoformat()}]: Unhandled RestClient Error:{exception_type}\n"
+            f"request:{request}\n"
+            "Exception trace: \n"
+            f"{trace}"
+        )
         return text
 
+    async def _close(self) -> None:
+        """关闭会话后，停止事件循环"""
+        # 无论关闭过程是否出错，都要停止事件循环，避免join一直阻塞
+        try:
+            # 停止批量处理，关闭期间不再创建新的请求任务
+            self.active = False
+
+            # 丢弃尚未开始处理的请求，并重置批量处理标志
+            self.pending_requests.clear()
+            self.drain_scheduled = False
+
+            # 被取消的请求不会归还已预约的流控时间，重置后重新计算
+            self.rate_tat = 0
+
+            # 取消尚未完成的请求任务
+            tasks: list[Task] = list(self.tasks)
+            for task in tasks:
+                task.cancel()
+            await gather(*tasks, return_exceptions=True)
+
+            # 丢弃等待任务退出期间加入的请求
+            self.pending_requests.clear()
+
+            # 关闭会话，释放连接池中的所有连接
+            if self.session:
+                session: ClientSession = self.session
+                self.session = None
+                self.connector = None
+                await session.close()
+        finally:
+            self.loop.stop()
+
+    def _drain_requests(self) -> None:
+        """在事件循环中批量取出待处理请求并创建任务"""
+        # 先清除标志再取出请求，确保之后加入的请求总会被再次调度
+        self.drain_scheduled = False
+
+        # 客户端关闭中，不再创建新的任务
+        if not self.active:
+            return
+
+        for _ in range(DRAIN_BATCH_SIZE):
+            if not self.pending_requests:
+                return
+
+            request: Request = self.pending_requests.popleft()
+            self._create_task(request)
+
+        # 仍有剩余请求时，先让出事件循环处理网络事件，下一轮再继续
+        if self.pending_requests:
+            self.drain_scheduled = True
+            self.loop.call_soon(self._drain_requests)
+
+    def _create_task(self, request: Request) -> None:
+        """在事件循环中创建请求处理任务"""
+        task: Task = self.loop.create_task(self._process_request(request))
+
+        # 保存任务的引用，防止执行过程中被垃圾回收
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
     async def _get_response(self, request: Request) -> Response:
         """发送请求到服务器，并返回处理结果对象"""
+        # 在签名前等待流控，避免签名中的时间戳过期
+        if self.rate_limit:
+            await self._wait_rate_limit()
+
         request = self.sign(request)
         url = self._make_full_url(request.path)
 
         if not self.connector:
-            self.connector = TCPConnector(verify_ssl=False)
+            self.connector = TCPConnector(
+                ssl=False,
+                limit=self.pool_size,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=300
+            )
 
         if not self.session:
             self.session = ClientSession(
                 connector=self.connector,
-                trust_env=True
+                timeout=ClientTimeout(total=self.timeout),
+                trust_env=False
             )
 
-        cr: ClientResponse = await self.session.request(
+        # 使用上下文管理器，确保连接能及时归还到连接池
+        async with self.session.request(
             request.method,
             url,
             headers=request.headers,
             params=request.params,
             data=request.data,
             json=request.json,
-            proxy=self.proxy
-        )
+            proxy=self.proxy,
+            proxy_auth=self.proxy_auth
+        ) as cr:
+            content: bytes = await cr.read()
+            status_code = cr.status
+            encoding: str = cr.charset or "utf-8"
+
+        request.response = Response(status_code, content, encoding)
+        return request.response
 
-        text: str = await cr.text()
-        status_code = cr.status
+    async def _wait_rate_limit(self) -> None:
+        """等待直到流控允许发送下一个请求"""
+        # 基于GCRA算法实现，最多允许1秒内的请求量突发
+        interval: float = 1 / self.rate_limit
+        tolerance: float = max(self.rate_limit - 1, 0) * interval
 
-        request.response = Response(status_code, text)
-        return request.response
+        now: float = self.loop.time()
+        tat: float = max(self.rate_tat, now)
+        self.rate_tat = tat + interval
+
+        delay: float = tat - tolerance - now
+        if delay > 0:
+            await sleep(delay)
 
     async def _process_request(self, request: Request) -> None:
         """发送请求到服务器，并对返回进行后续处理"""
@@ -286,7 +510,7 @@ class RestClient(object):
             status_code: int = response.status_code
 
             # 2xx的代码表示处理成功
-            if status_code // 100 == 2:
+            if 200 <= status_code < 300:
                 request.callback(response.json(), request)
             # 否则说明处理失败
             else:
@@ -296,8 +520,8 @@ class RestClient(object):
                 # 否则使用全局失败回调
                 else:
                     self.on_failed(status_code, request)
-        except Exception:
-            t, v, tb = sys.exc_info()
+        except Exception as e:
+            t, v, tb = type(e), e, e.__traceback__
             # 设置了专用异常回调
             if request.on_error:
                 request.on_error(t, v, tb, request)
@@ -311,16 +535,58 @@ class RestClient(object):
         return url
 
 
-def start_event_loop(loop: AbstractEventLoop) -> None:
+def get_env_proxy(url: str) -> tuple[Optional[str], Optional[BasicAuth]]:
+    """读取环境变量中访问该地址所需的代理设置"""
+    parts: SplitResult = urlsplit(url)
+
+    # 地址在no_proxy中，则不使用代理
+    if parts.hostname and proxy_bypass(parts.hostname):
+        return None, None
+
+    proxy: str = getproxies().get(parts.scheme, "")
+    if not proxy:
+        return None, None
+
+    if "://" not in proxy:
+        proxy = "http://" + proxy
+
+    # aiohttp只支持HTTP代理
+    proxy_parts: SplitResult = urlsplit(proxy)
+    if proxy_parts.scheme != "http" or not proxy_parts.hostname:
+        return None, None
+
+    # 代理地址中的用户名和密码需要单独作为认证信息传入
+    proxy_auth: BasicAuth = None
+    if proxy_parts.username:
+        proxy_auth = BasicAuth(
+            unquote(proxy_parts.username),
+            unquote(proxy_parts.password or "")
+        )
+
+    host: str = proxy_parts.netloc.rpartition("@")[2]
+    return f"http://{host}", proxy_auth
+
+
+def start_event_loop(loop: AbstractEventLoop) -> Optional[Thread]:
     """启动事件循环"""
     # 如果事件循环未运行，则创建后台线程来运行
     if not loop.is_running():
         thread = Thread(target=run_event_loop, args=(loop,))
         thread.daemon = True
         thread.start()
+        return thread
+
+    return None
 
 
 def run_event_loop(loop: AbstractEventLoop) -> None:
     """运行事件循环"""
     set_event_loop(loop)
     loop.run_forever()
+
+    # 事件循环停止后将其关闭，释放占用的文件描述符和线程池
+    try:
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.run_until_complete(loop.shutdown_default_executor())
+    finally:
+        loop.close()